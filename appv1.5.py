@@ -6,152 +6,333 @@ author_url2: https://urlz.fr/uj1I [CAEDHET/HCDH Heidelberg University]
 version: 1.0
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import os
-import subprocess
+import json
+import array
+import functools
+import gzip
+import hashlib
 import re
 import requests
+from requests.adapters import HTTPAdapter
 from readability import Document
 import fitz
+import lxml.html
+from lxml.etree import ParserError
 from bs4 import BeautifulSoup
 import tiktoken
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+class OrjsonProvider(DefaultJSONProvider):
+    # The extracted content round-trips through JSON, so the encoder is on the hot path
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Uploads above this size are rejected before Werkzeug spools them
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get("MAX_UPLOAD_MB", "200")) * 1024 * 1024
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+OLLAMA_BASE  = "http://localhost:11434/api"
+OLLAMA_MODEL = "llama3.1"
+# Should match OLLAMA_NUM_PARALLEL on the Ollama server so the block requests actually run side by side
+LLM_WORKERS  = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32))
+SESSION.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+URL_WORKERS = 8
+# Plain text for the LLM does not need ligatures kept as single glyphs
+PDF_TEXT_FLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_PRESERVE_LIGATURES
+
 # --------------------------
 # Tokenization and help functions
 # --------------------------
 TOKEN_LIMIT = 131072
+BATCH_ENCODE_CHARS = 1 << 20
+# gpt2 BPE averages about 4 characters per token
+CHARS_PER_TOKEN = 4
+MAX_CONTENT_CHARS = 10 * TOKEN_LIMIT * CHARS_PER_TOKEN
 enc = tiktoken.get_encoding("gpt2")
 
+CACHE_SIZE = 128
+_cache_lock = threading.Lock()
+PDF_TEXT_CACHE = {}
+ANSWER_CACHE = {}
+
+def cache_get(cache, key):
+    with _cache_lock:
+        if key not in cache:
+            return None
+        # Re-insert so the dict order doubles as least-recently-used order
+        value = cache.pop(key)
+        cache[key] = value
+        return value
+
+def cache_put(cache, key, value):
+    with _cache_lock:
+        cache.pop(key, None)
+        cache[key] = value
+        if len(cache) > CACHE_SIZE:
+            cache.pop(next(iter(cache)))
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
 def tokenize_text(text):
-    return enc.encode(text)
+    return enc.encode_ordinary(text)
+
+def _tokenize_large_text(text):
+    # Cut before a space so every piece starts where the BPE pre-tokenizer would split anyway
+    pieces = []
+    start = 0
+    while start < len(text):
+        stop = text.find(" ", start + BATCH_ENCODE_CHARS)
+        stop = len(text) if stop == -1 else stop
+        pieces.append(text[start:stop])
+        start = stop
+    tokens = array.array('I')
+    for batch in enc.encode_ordinary_batch(pieces, num_threads=os.cpu_count() or 1):
+        tokens.extend(batch)
+    return tokens
 
 def detokenize_text(tokens):
     return enc.decode(tokens)
 
+@functools.lru_cache(maxsize=8)
+def _encode_cached(text):
+    # Repeated questions against the same document reuse its token array,
+    # stored as 4-byte ints instead of a list of Python ints
+    if len(text) > BATCH_ENCODE_CHARS:
+        return _tokenize_large_text(text)
+    return array.array('I', tokenize_text(text))
+
 def split_text_into_blocks(text, max_tokens):
-    tokens = tokenize_text(text)
+    tokens = _encode_cached(text)
     for i in range(0, len(tokens), max_tokens):
-        yield detokenize_text(tokens[i : i + max_tokens])
+        yield detokenize_text(tokens[i : i + max_tokens].tolist())
 
 # --------------------------
 # Functions for extracting content
 # --------------------------
+_WS = re.compile(r'\s+')
+_NL = re.compile(r'\s*\n\s*')
+_MULTI_WS = re.compile(r'\s{2,}')
+
 def get_readable_content(url):
     try:
-        response = requests.get(url, timeout=30)
+        response = SESSION.get(url, timeout=30)
         response.raise_for_status()
         doc = Document(response.text)
         readable_html = doc.summary()
-        soup = BeautifulSoup(readable_html, 'html.parser')
-        readable_text = soup.get_text()
-        return re.sub(r'\s+', ' ', readable_text).strip()
+        try:
+            readable_text = lxml.html.fromstring(readable_html).text_content()
+        except (ParserError, ValueError):
+            readable_text = BeautifulSoup(readable_html, 'html.parser').get_text()
+        return _WS.sub(' ', readable_text).strip()
     except requests.exceptions.RequestException as e:
         return f"Error fetching content: {str(e)}"
 
-def extract_text_from_pdf(file):
-    text = ""
-    pdf_data = file.read()
+def _extract_bytes(pdf_data):
     try:
         with fitz.open(stream=pdf_data, filetype="pdf") as pdf:
-            for page in pdf:
-                text += page.get_text()
+            text = "".join(page.get_text("text", flags=PDF_TEXT_FLAGS) for page in pdf)
     except Exception as e:
         return f"Error reading PDF: {str(e)}"
-    cleaned_text = re.sub(r'\s*\n\s*', ' ', text)
-    cleaned_text = re.sub(r'\s{2,}', ' ', cleaned_text)
+    cleaned_text = _NL.sub(' ', text)
+    cleaned_text = _MULTI_WS.sub(' ', cleaned_text)
     return cleaned_text.strip()
 
+def extract_text_from_pdf(file):
+    pdf_data = file.read()
+    key = content_hash(pdf_data)
+    text = cache_get(PDF_TEXT_CACHE, key)
+    if text is None:
+        text = _extract_bytes(pdf_data)
+        if not text.startswith("Error reading PDF"):
+            cache_put(PDF_TEXT_CACHE, key, text)
+    return text
+
 def extract_content(url_input, pdf_files):
-    all_content = ""
+    chunks = []
     if url_input:
         urls = [url.strip() for url in url_input.split(",")]
-        for url in urls:
-            if url.startswith("http"):
-                all_content += get_readable_content(url) + "\n"
-    if pdf_files:
-        for pdf_file in pdf_files:
-            pdf_text = extract_text_from_pdf(pdf_file)
-            all_content += pdf_text + "\n"
-    return all_content.strip() or "No content extracted from the provided inputs."
+        urls = [url for url in urls if url.startswith("http")]
+        if urls:
+            with ThreadPoolExecutor(max_workers=min(URL_WORKERS, len(urls))) as executor:
+                chunks.extend(executor.map(get_readable_content, urls))
+    if pdf_files and len(pdf_files) == 1:
+        chunks.append(extract_text_from_pdf(pdf_files[0]))
+    elif pdf_files:
+        # FileStorage objects are not picklable, so the bytes are read here and parsed in worker processes
+        pdf_datas = [pdf_file.read() for pdf_file in pdf_files]
+        keys = [content_hash(pdf_data) for pdf_data in pdf_datas]
+        texts = [cache_get(PDF_TEXT_CACHE, key) for key in keys]
+        missing = [i for i, text in enumerate(texts) if text is None]
+        if missing:
+            missing_datas = [pdf_datas[i] for i in missing]
+            try:
+                with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(missing))) as executor:
+                    extracted = list(executor.map(_extract_bytes, missing_datas))
+            except Exception:
+                # A broken pool or pickling failure falls back to parsing in this process
+                extracted = [_extract_bytes(pdf_data) for pdf_data in missing_datas]
+            for i, text in zip(missing, extracted):
+                texts[i] = text
+                if not text.startswith("Error reading PDF"):
+                    cache_put(PDF_TEXT_CACHE, keys[i], text)
+        chunks.extend(texts)
+    return "\n".join(chunks).strip() or "No content extracted from the provided inputs."
 
 # --------------------------
 # Functions for answering questions
 # --------------------------
-def query_llama_via_cli(input_text):
+MODEL_ERROR_MESSAGES = (
+    "The model request timed out.",
+    "Error in the model request:",
+    "An unexpected error has occurred:",
+)
+
+def stream_llama_via_http(input_text, on_open=None):
     try:
-        result = subprocess.run(
-            ["ollama", "run", "llama3.1"],
-            input=f"{input_text}\n",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            timeout=60
-        )
-        if result.returncode != 0:
-            return f"Error in the model request: {result.stderr.strip()}"
-        response = re.sub(r'\x1b\[.*?m', '', result.stdout)
-        return response.strip()
-    except subprocess.TimeoutExpired:
-        return "The model request timed out. Please try again."
+        with SESSION.post(
+            f"{OLLAMA_BASE}/generate",
+            json={"model": OLLAMA_MODEL, "prompt": input_text, "stream": True},
+            stream=True,
+            timeout=300
+        ) as response:
+            if on_open is not None:
+                on_open(response)
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line).get("response", "")
+    except requests.exceptions.Timeout:
+        yield "The model request timed out. Please try again."
+    except requests.exceptions.RequestException as e:
+        yield f"Error in the model request: {str(e)}"
     except Exception as e:
-        return f"An unexpected error has occurred: {str(e)}"
+        yield f"An unexpected error has occurred: {str(e)}"
+
+STYLE_INSTRUCTIONS = {
+    "Beginner": (
+        "Respond in very simple words, avoid technical terms, and keep the answer short and concise. "
+        "Explain the topic in a way that even laypersons can understand."
+    ),
+    "Intermediate": (
+        "Provide a clear and detailed response, occasionally using technical terms and offering a balanced explanation. "
+        "Explain the topic so that the reader gains a good understanding without it becoming too technical."
+    ),
+    "Advanced": (
+        "Provide a highly detailed and technical response, use specialized terminology, and offer a comprehensive analysis. "
+        "Explain the topic at a high, academic level."
+    ),
+}
+DEFAULT_STYLE_INSTRUCTION = "Respond based on the provided information."
 
-def generate_responses_from_blocks(competence_level, extracted_content, user_question):
-    if not competence_level or not user_question.strip():
-        return "Please select a competence level and enter a question."
-    if not extracted_content.strip():
-        return "No content extracted on which the answer could be based."
-    
-    if competence_level == "Beginner":
-        style_instruction = (
-            "Respond in very simple words, avoid technical terms, and keep the answer short and concise. "
-            "Explain the topic in a way that even laypersons can understand."
-        )
-    elif competence_level == "Intermediate":
-        style_instruction = (
-            "Provide a clear and detailed response, occasionally using technical terms and offering a balanced explanation. "
-            "Explain the topic so that the reader gains a good understanding without it becoming too technical."
-        )
-    elif competence_level == "Advanced":
-        style_instruction = (
-            "Provide a highly detailed and technical response, use specialized terminology, and offer a comprehensive analysis. "
-            "Explain the topic at a high, academic level."
-        )
-    else:
-        style_instruction = "Respond based on the provided information."
-    
-    base_prompt = (
+def build_base_prompt(style_instruction):
+    return (
         f"System Instruction: {style_instruction}\n\n"
         "Note: The following information serves only as a reference. Please phrase the answer in your own words and consider the desired style.\n\n"
-        "Provided Information (Excerpt):\n"
     )
-    question_prompt = f"\n\nQuestion: {user_question}\n\nAnswer:"
-    
-    prompt_prefix_tokens = len(tokenize_text(base_prompt)) + len(tokenize_text(question_prompt))
-    max_tokens_for_block = TOKEN_LIMIT - prompt_prefix_tokens
 
-    responses = []
-    for block in split_text_into_blocks(extracted_content, max_tokens_for_block):
-        input_text = base_prompt + block + question_prompt
-        response = query_llama_via_cli(input_text)
-        responses.append(response)
-    return "\n".join(responses)
+BASE_PROMPTS = {level: build_base_prompt(instruction) for level, instruction in STYLE_INSTRUCTIONS.items()}
+DEFAULT_BASE_PROMPT = build_base_prompt(DEFAULT_STYLE_INSTRUCTION)
+BASE_PROMPT_TOKENS = {base_prompt: len(tokenize_text(base_prompt))
+                      for base_prompt in [*BASE_PROMPTS.values(), DEFAULT_BASE_PROMPT]}
 
-def generate_response_from_extracted_content(competence_level, extracted_content, url_input, pdf_files, user_question):
+def check_block_inputs(competence_level, extracted_content, user_question):
     if not competence_level or not user_question.strip():
         return "Please select a competence level and enter a question."
-    
     if not extracted_content.strip():
-        if not url_input.strip() and not pdf_files:
-            return "Please provide either a URL or upload a PDF file to proceed."
-        else:
-            return "No content extracted to base the answer on."
+        return "No content extracted on which the answer could be based."
+    if len(extracted_content) > MAX_CONTENT_CHARS:
+        return "The extracted content is too large to be processed. Please provide fewer or shorter sources."
+    return None
+
+def build_block_prompts(competence_level, extracted_content, user_question):
+    base_prompt = BASE_PROMPTS.get(competence_level, DEFAULT_BASE_PROMPT)
+    # Instruction and question come first and stay byte-identical for every block,
+    # so Ollama can reuse the cached prefix and only prefill the varying excerpt.
+    question_prompt = f"Question: {user_question}\n\nProvided Information (Excerpt):\n"
+    answer_prompt = "\n\nAnswer:"
     
-    return generate_responses_from_blocks(competence_level, extracted_content, user_question)
+    prompt_prefix_tokens = BASE_PROMPT_TOKENS[base_prompt] + len(tokenize_text(question_prompt + answer_prompt))
+    max_tokens_for_block = TOKEN_LIMIT - prompt_prefix_tokens
+
+    # Content this short fits into a single request, so it is sent without tokenizing it
+    if len(extracted_content) < max_tokens_for_block * 2:
+        return [base_prompt + question_prompt + extracted_content + answer_prompt]
+
+    return [base_prompt + question_prompt + block + answer_prompt
+            for block in split_text_into_blocks(extracted_content, max_tokens_for_block)]
+
+def cache_answer(key, answer):
+    # Failed model requests are not cached so that the next attempt retries them
+    if not any(message in answer for message in MODEL_ERROR_MESSAGES):
+        cache_put(ANSWER_CACHE, key, answer)
+
+def _stream_block_prompts(prompts):
+    if len(prompts) == 1:
+        yield from stream_llama_via_http(prompts[0])
+        return
+    # The first block is streamed to the client while the remaining blocks are
+    # streamed into buffers in the background
+    open_responses = []
+    cancelled = threading.Event()
+
+    def register(response):
+        open_responses.append(response)
+        if cancelled.is_set():
+            response.close()
+
+    def answer_block(prompt):
+        if cancelled.is_set():
+            return ""
+        return "".join(stream_llama_via_http(prompt, register)).strip()
+
+    executor = ThreadPoolExecutor(max_workers=min(LLM_WORKERS, len(prompts) - 1))
+    futures = [executor.submit(answer_block, prompt) for prompt in prompts[1:]]
+    try:
+        yield from stream_llama_via_http(prompts[0])
+        for future in futures:
+            yield "\n" + future.result()
+    finally:
+        # If the client disconnects, Flask closes this generator. Queued blocks are
+        # dropped and running ones have their connections closed, which makes Ollama
+        # stop generating for them.
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        for response in list(open_responses):
+            response.close()
+
+def stream_responses_from_blocks(competence_level, extracted_content, user_question):
+    error = check_block_inputs(competence_level, extracted_content, user_question)
+    if error:
+        yield error
+        return
+
+    key = (content_hash(extracted_content), competence_level, user_question)
+    answer = cache_get(ANSWER_CACHE, key)
+    if answer is not None:
+        yield answer
+        return
+
+    parts = []
+    for part in _stream_block_prompts(build_block_prompts(competence_level, extracted_content, user_question)):
+        parts.append(part)
+        yield part
+    cache_answer(key, "".join(parts))
 
 def clear_extracted_content():
     return ""
@@ -488,32 +669,6 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
 
-  function typeWriterHTML(html, element, speed = 5) {
-    let i = 0;
-    let isTag = false; 
-    let output = "";
-
-    function type() {
-      if (i < html.length) {
-        let char = html[i];
-        output += char;
-        
-        if (char === "<") {
-          isTag = true;
-        }
-        if (char === ">") {
-          isTag = false;
-        }
-        
-        element.innerHTML = output;
-        
-        i++;
-        setTimeout(type, isTag ? 0 : speed);
-      }
-    }
-    type();
-  }
-
   extractBtn.addEventListener('click', function() {
     const urls = urlInput.value.trim();
     const files = pdfInput.files;
@@ -579,12 +734,39 @@ document.addEventListener('DOMContentLoaded', function() {
         question: question
       })
     })
-    .then(response => response.json())
-    .then(data => {
-      spinner.style.display = 'none';
-      responseDiv.style.display = 'block';
+    .then(async response => {
+      if ((response.headers.get('Content-Type') || '').startsWith('application/json')) {
+        const data = await response.json();
+        spinner.style.display = 'none';
+        responseDiv.style.display = 'block';
+        responseDiv.innerHTML = marked.parse(data.response);
+        return;
+      }
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let text = "";
+      let renderScheduled = false;
       responseDiv.innerHTML = "";
-      typeWriterHTML(marked.parse(data.response), responseDiv, 5);
+      // Chunks often arrive faster than the screen refreshes, so the markdown
+      // is parsed at most once per frame instead of once per chunk
+      const render = () => {
+        renderScheduled = false;
+        responseDiv.innerHTML = marked.parse(text);
+      };
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        spinner.style.display = 'none';
+        responseDiv.style.display = 'block';
+        text += decoder.decode(value, { stream: true });
+        if (!renderScheduled) {
+          renderScheduled = true;
+          requestAnimationFrame(render);
+        }
+      }
+      text += decoder.decode();
+      render();
+      spinner.style.display = 'none';
     })
     .catch(error => {
       spinner.style.display = 'none';
@@ -595,20 +777,45 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 """
 
+def build_static_asset(content):
+    raw = content.encode('utf-8')
+    etag = hashlib.sha1(raw).hexdigest()
+    return {"raw": raw, "gzip": gzip.compress(raw), "etag": etag}
+
+# Compressed once at startup so page loads cost no CPU
+STATIC_ASSETS = {
+    "html": build_static_asset(HTML_CONTENT),
+    "css": build_static_asset(CSS_CONTENT),
+    "js": build_static_asset(JS_CONTENT),
+}
+
+def serve_static_asset(name, mimetype):
+    asset = STATIC_ASSETS[name]
+    if 'gzip' in request.accept_encodings:
+        response = Response(asset["gzip"], mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(asset["etag"] + "-gz")
+    else:
+        response = Response(asset["raw"], mimetype=mimetype)
+        response.set_etag(asset["etag"])
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 # --------------------------
 # Flask endpoints
 # --------------------------
 @app.route('/')
 def index():
-    return Response(HTML_CONTENT, mimetype='text/html')
+    return serve_static_asset("html", 'text/html')
 
 @app.route('/styles.css')
 def styles():
-    return Response(CSS_CONTENT, mimetype='text/css')
+    return serve_static_asset("css", 'text/css')
 
 @app.route('/script.js')
 def script():
-    return Response(JS_CONTENT, mimetype='application/javascript')
+    return serve_static_asset("js", 'application/javascript')
 
 @app.route('/extract_content', methods=['POST'])
 def extract_content_endpoint():
@@ -632,13 +839,18 @@ def ask_question():
         return jsonify({"response": "Please select a competence level and enter a question."})
     if not extracted_content.strip():
         return jsonify({"response": "No extracted content available."})
-    response = generate_response_from_extracted_content(competence_level, extracted_content, "", None, user_question)
-    return jsonify({"response": response})
+    stream = stream_responses_from_blocks(competence_level, extracted_content, user_question)
+    return Response(stream_with_context(stream), mimetype='text/plain')
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({"content": f"The uploaded files exceed the limit of {limit_mb} MB."}), 413
 
 @app.route('/clear_extracted', methods=['POST'])
 def clear_extracted():
     return jsonify({"content": ""})
 
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=5000) 
+    app.run(host="0.0.0.0", port=5000)
 
@@ -7,9 +7,13 @@ version: 1.0
 """
 
 import os
-import subprocess
 import re
+import time
+import functools
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import fitz
 import tiktoken
 import logging
@@ -17,10 +21,12 @@ import asyncio
 import uuid
 import edge_tts
 import json
+import orjson
 import faiss
 import numpy as np
 from bs4 import BeautifulSoup
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from duckduckgo_search import DDGS
 from datetime import datetime
 from readability import Document
@@ -29,11 +35,42 @@ from flask import Flask, request, jsonify, Response, current_app, send_from_dire
 
 index = None
 metadatas = []
+source_to_indices = defaultdict(list)
+# Serializes changes to the index and its metadata made by concurrent requests
+index_lock = threading.Lock()
+# Held only while the index state is swapped or read, so a request never sees
+# an index together with the chunk lists or source map of another version
+index_state_lock = threading.Lock()
+INDEX_FILES = ("rag_index.faiss", "rag_meta.json", "rag_chunks.json")
 all_chunks = []
-all_embeddings = None
+chunk_token_counts = []
 
 OLLAMA_BASE      = "http://localhost:11434/api"
 OLLAMA_EMBED_MOD = "nomic-embed-text"
+OLLAMA_KEEP_ALIVE = "30m"
+EMBED_BATCH_SIZE = 32
+EMBED_WORKERS    = 8
+# Upper bound for concurrent generate requests so a local Ollama is not flooded
+LLM_WORKERS      = 8
+
+ollama_session = requests.Session()
+ollama_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+URL_WORKERS = 8
+web_session = requests.Session()
+web_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+web_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+# Below HNSW_MAX_VECTORS an HNSW graph is used, above it an IVF index whose
+# training needs enough vectors per centroid. Both store fp16 scalar-quantized,
+# L2-normalized vectors and rank by inner product (cosine similarity). The
+# search parameters are not stored by faiss.write_index and are restored in
+# load_faiss_index.
+HNSW_MAX_VECTORS     = 50000
+HNSW_M               = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH       = 64
+IVF_MIN_NPROBE       = 8
 
 app = Flask(__name__)
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
@@ -48,27 +85,85 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(mes
 
 TOKEN_LIMIT = 131072
 token_limit = TOKEN_LIMIT
+RAG_TOP_K = 8
+READABLE_CACHE_SIZE = 256
+QUERY_EMBED_CACHE_SIZE = 512
 enc = tiktoken.get_encoding("gpt2")
 
+def create_faiss_index(embs):
+    n, d = embs.shape
+    if n < HNSW_MAX_VECTORS:
+        new_index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_fp16, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        new_index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        nlist = int(4 * np.sqrt(n))
+        new_index = faiss.index_factory(d, f"IVF{nlist},SQfp16", faiss.METRIC_INNER_PRODUCT)
+    prepare_vectors(new_index, embs)
+    new_index.train(embs)
+    new_index.add(embs)
+    set_search_params(new_index)
+    return new_index
+
+def prepare_vectors(idx, embs):
+    # Indexes built before the switch to inner product are still L2 and take raw vectors
+    if idx.metric_type == faiss.METRIC_INNER_PRODUCT:
+        faiss.normalize_L2(embs)
+    return embs
+
+def set_search_params(idx):
+    if isinstance(idx, faiss.IndexHNSW):
+        idx.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(idx, faiss.IndexIVF):
+        idx.nprobe = max(IVF_MIN_NPROBE, idx.nlist // 32)
+
+def publish_index_state(new_index, new_metadatas, new_chunks, new_token_counts):
+    # The published objects are never mutated afterwards, writers build new ones
+    global index, metadatas, all_chunks, chunk_token_counts, source_to_indices
+    new_source_to_indices = defaultdict(list)
+    for i, meta in enumerate(new_metadatas):
+        new_source_to_indices[meta["source"]].append(i)
+    with index_state_lock:
+        index              = new_index
+        metadatas          = new_metadatas
+        all_chunks         = new_chunks
+        chunk_token_counts = new_token_counts
+        source_to_indices  = new_source_to_indices
+
+def index_state_snapshot():
+    with index_state_lock:
+        return index, metadatas, all_chunks, chunk_token_counts, source_to_indices
+
 def load_faiss_index():
-    global index, metadatas, all_chunks, all_embeddings
     if os.path.exists("rag_index.faiss") and os.path.exists("rag_meta.json"):
-        index = faiss.read_index("rag_index.faiss")
-        with open("rag_meta.json", "r", encoding="utf-8") as f:
-            metadatas = json.load(f)
-        with open("rag_chunks.json", "r", encoding="utf-8") as f:
-            all_chunks = json.load(f)
-        all_embeddings = index.reconstruct_n(0, index.ntotal)
+        loaded_index = faiss.read_index("rag_index.faiss")
+        set_search_params(loaded_index)
+        with open("rag_meta.json", "rb") as f:
+            loaded_metas = orjson.loads(f.read())
+        with open("rag_chunks.json", "rb") as f:
+            stored_chunks = orjson.loads(f.read())
+        # Older indexes stored plain strings without token counts
+        publish_index_state(
+            loaded_index, loaded_metas,
+            [c["text"] if isinstance(c, dict) else c for c in stored_chunks],
+            [c["ntok"] if isinstance(c, dict) else len(tokenize_text(c)) for c in stored_chunks])
     else:
         logging.warning("FAISS index or metadata not found!")
 
+LEVEL_INSTRUCTIONS = {
+    "Beginner":     "answer briefly and simply",
+    "Intermediate": "answer in a balanced manner at a moderate level",
+}
+DEFAULT_LEVEL_INSTRUCTION = "explain in detail at an advanced level"
+
+# The per-source answers in /ask_question have always used shorter wording
+PER_SOURCE_LEVEL_INSTRUCTIONS = {
+    "Beginner":     "answer briefly and simply",
+    "Intermediate": "answer in a balanced manner",
+}
+DEFAULT_PER_SOURCE_LEVEL_INSTRUCTION = "explain in detail"
+
 def answer_per_source(competence, src, content, question, selected_model):
-    if competence == "Beginner":
-        level_instr = "answer briefly and simply"
-    elif competence == "Intermediate":
-        level_instr = "answer in a balanced manner"
-    else:
-        level_instr = "explain in detail"
+    level_instr = PER_SOURCE_LEVEL_INSTRUCTIONS.get(competence, DEFAULT_PER_SOURCE_LEVEL_INSTRUCTION)
 
     prompt = (
         f"System: You are an intelligent assistant. {level_instr}. "
@@ -80,18 +175,23 @@ def answer_per_source(competence, src, content, question, selected_model):
     return query_llama_via_cli(prompt, selected_model)
 
 
+_TTS_MARKDOWN_PATTERNS = [
+    (re.compile(r'\*\*([^*]+)\*\*'), r'\1'),
+    (re.compile(r'\*([^*]+)\*'), r'\1'),
+    (re.compile(r'__([^_]+)__'), r'\1'),
+    (re.compile(r'_([^_]+)_'), r'\1'),
+    (re.compile(r'`([^`]+)`'), r'\1'),
+    (re.compile(r'\[([^\]]+)\]\([^)]+\)'), r'\1'),
+    (re.compile(r'<[^>]+>'), ''),
+]
+_TTS_STRIP = re.compile(r'[#>\-•●‣→⇒]')
+_WS = re.compile(r'\s+')
+
 def clean_text_for_tts(text):
-    import re
-    text = re.sub(r'\*\*([^*]+)\*\*', r'\1', text)  
-    text = re.sub(r'\*([^*]+)\*', r'\1', text)    
-    text = re.sub(r'__([^_]+)__', r'\1', text)  
-    text = re.sub(r'_([^_]+)_', r'\1', text) 
-    text = re.sub(r'`([^`]+)`', r'\1', text)
-    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text) 
-    text = re.sub(r'<[^>]+>', '', text)  
-    text = re.sub(r'[#>\-]', '', text) 
-    text = re.sub(r'[•●‣→⇒]', '', text)  
-    text = re.sub(r'\s+', ' ', text)
+    for pattern, repl in _TTS_MARKDOWN_PATTERNS:
+        text = pattern.sub(repl, text)
+    text = _TTS_STRIP.sub('', text)
+    text = _WS.sub(' ', text)
     return text.strip()
 
 def build_rag_prompt(retrieved, question, level_instr):
@@ -143,34 +243,106 @@ def build_rag_prompt(retrieved, question, level_instr):
         "Antwort:"
     )
 
-def embed_via_ollama(texts: list[str]) -> list[list[float]]:
-    payload = {"model": OLLAMA_EMBED_MOD, "input": texts}
-    resp    = requests.post(f"{OLLAMA_BASE}/embed", json=payload, timeout=30)
+_query_embed_cache = OrderedDict()
+_query_embed_lock = threading.Lock()
+
+def embed_query(text: str) -> np.ndarray:
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    with _query_embed_lock:
+        emb = _query_embed_cache.get(key)
+        if emb is not None:
+            _query_embed_cache.move_to_end(key)
+    if emb is None:
+        # A single text needs neither the batching nor the thread pool of embed_via_ollama
+        emb = np.asarray(embed_batch_via_ollama([text]), dtype=np.float32)
+        with _query_embed_lock:
+            _query_embed_cache[key] = emb
+            if len(_query_embed_cache) > QUERY_EMBED_CACHE_SIZE:
+                _query_embed_cache.popitem(last=False)
+    # Callers normalize in place, so the cached array is never handed out
+    return emb.copy()
+
+def embed_batch_via_ollama(texts: list[str]) -> list[list[float]]:
+    payload = {"model": OLLAMA_EMBED_MOD, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE}
+    resp    = ollama_session.post(f"{OLLAMA_BASE}/embed", json=payload, timeout=30)
     resp.raise_for_status()
     return resp.json()["embeddings"]
 
+def embed_via_ollama(texts: list[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    # Batches of similar length keep one long chunk from holding up a whole batch
+    order   = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+    # Rows are written straight into one float32 buffer as batches come back
+    embs = None
+    with ThreadPoolExecutor(max_workers=min(EMBED_WORKERS, len(batches))) as executor:
+        results = executor.map(lambda batch: embed_batch_via_ollama([texts[i] for i in batch]), batches)
+        for batch, batch_embeddings in zip(batches, results):
+            batch_embs = np.asarray(batch_embeddings, dtype=np.float32)
+            if embs is None:
+                embs = np.empty((len(texts), batch_embs.shape[1]), dtype=np.float32)
+            embs[batch] = batch_embs
+    return np.ascontiguousarray(embs)
+
+tts_executor = ThreadPoolExecutor(max_workers=2)
+# Output paths of MP3s that are still being rendered
+tts_jobs = set()
+
 async def _generate_tts(text, voice, out_path):
-    await edge_tts.Communicate(text=text, voice=voice).save(out_path)
+    # Written under a temporary name so a half-written MP3 is never served
+    await edge_tts.Communicate(text=text, voice=voice).save(out_path + ".part")
+    os.replace(out_path + ".part", out_path)
+
+def _run_tts(text, voice, out_path):
+    try:
+        asyncio.run(_generate_tts(clean_text_for_tts(text), voice, out_path))
+    except Exception as e:
+        logging.debug("Error generating TTS %s: %s", out_path, str(e))
+        if os.path.exists(out_path + ".part"):
+            os.remove(out_path + ".part")
+    finally:
+        tts_jobs.discard(out_path)
 
 def generate_tts_conv(text, conv_id, voice="en-GB-ThomasNeural"):
-    text = clean_text_for_tts(text)
     conv_dir = os.path.join(CONV_ROOT, conv_id)
     os.makedirs(conv_dir, exist_ok=True)
     fname = f"{uuid.uuid4().hex}.mp3"
     out_path = os.path.join(conv_dir, fname)
-    asyncio.run(_generate_tts(text, voice, out_path))
+    # Registered before submitting so a job that fails at once cannot be re-added afterwards
+    tts_jobs.add(out_path)
+    tts_executor.submit(_run_tts, text, voice, out_path)
     return fname
 
+def migrate_legacy_log(conv_dir):
+    legacy_path = os.path.join(conv_dir, "log.json")
+    if not os.path.exists(legacy_path):
+        return
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        legacy_log = json.load(f)
+    with open(os.path.join(conv_dir, "log.jsonl"), "a", encoding="utf-8") as f:
+        for entry in legacy_log:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.remove(legacy_path)
+
 def append_to_log(conv_id, entry: dict):
     conv_dir = os.path.join(CONV_ROOT, conv_id)
-    log_path = os.path.join(conv_dir, "log.json")
-    log = []
-    if os.path.exists(log_path):
-        with open(log_path, "r", encoding="utf-8") as f:
-            log = json.load(f)
-    log.append(entry)
-    with open(log_path, "w", encoding="utf-8") as f:
-        json.dump(log, f, ensure_ascii=False, indent=2)
+    os.makedirs(conv_dir, exist_ok=True)
+    log_path = os.path.join(conv_dir, "log.jsonl")
+    if not os.path.exists(log_path):
+        migrate_legacy_log(conv_dir)
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def read_log(conv_id):
+    log_path = os.path.join(CONV_ROOT, conv_id, "log.jsonl")
+    if not os.path.exists(log_path):
+        return
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
 
 def tokenize_text(text):
     return enc.encode(text)
@@ -178,87 +350,150 @@ def tokenize_text(text):
 def detokenize_text(tokens):
     return enc.decode(tokens)
 
-def split_text_into_blocks(text, max_tokens):
-    tokens = tokenize_text(text)
+def split_token_ids(tokens, max_tokens):
     for i in range(0, len(tokens), max_tokens):
-        yield detokenize_text(tokens[i : i + max_tokens])
+        yield tokens[i : i + max_tokens]
+
+def split_text_into_token_blocks(text, max_tokens):
+    return list(split_token_ids(tokenize_text(text), max_tokens))
+
+@functools.lru_cache(maxsize=READABLE_CACHE_SIZE)
+def _cached_readable(url):
+    # Failed fetches raise and are therefore not cached
+    response = web_session.get(url, timeout=10)
+    response.raise_for_status()
+    doc = Document(response.text)
+    readable_html = doc.summary()
+    soup = BeautifulSoup(readable_html, 'html.parser')
+    readable_text = soup.get_text()
+    return _WS.sub(' ', readable_text).strip()
 
 def get_readable_content(url):
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        doc = Document(response.text)
-        readable_html = doc.summary()
-        soup = BeautifulSoup(readable_html, 'html.parser')
-        readable_text = soup.get_text()
-        return re.sub(r'\s+', ' ', readable_text).strip()
+        return _cached_readable(url)
     except requests.exceptions.RequestException as e:
         logging.debug("Error fetching content from URL %s: %s", url, str(e))
         return f"Error fetching content: {str(e)}"
 
-def build_faiss_index(extracted_contents_by_file: dict[str, str],
-                      max_tokens_per_chunk: int = 1024) -> None:
-    global index, metadatas, all_chunks, all_embeddings
-
-    all_chunks, metadatas = [], []
-
+def chunk_files(extracted_contents_by_file: dict[str, str],
+                max_tokens_per_chunk: int) -> tuple[list[str], list[int], list[dict]]:
+    chunks, ntoks, metas = [], [], []
     for fname, text in extracted_contents_by_file.items():
         if not text.strip():
-            continue         
-        chunks = list(split_text_into_blocks(text, max_tokens_per_chunk))
-        if not chunks:
-            continue     
-        all_chunks.extend(chunks)
-        metadatas.extend([{"source": fname} for _ in chunks])
-
-    if not all_chunks:
-        logging.warning("No chunks found – FAISS index will not be created.")
-        index          = None
-        all_embeddings = None
+            continue
+        blocks = split_text_into_token_blocks(text, max_tokens_per_chunk)
+        chunks.extend(enc.decode_batch(blocks))
+        ntoks.extend(len(ids) for ids in blocks)
+        metas.extend({"source": fname} for _ in blocks)
+    return chunks, ntoks, metas
+
+def save_faiss_index():
+    faiss.write_index(index, "rag_index.faiss")
+    with open("rag_meta.json", "wb") as f:
+        f.write(orjson.dumps(metadatas))
+
+    with open("rag_chunks.json", "wb") as f:
+        f.write(orjson.dumps([{"text": text, "ntok": ntok} for text, ntok in zip(all_chunks, chunk_token_counts)]))
+
+def drop_source_from_index(source: str) -> None:
+    if index is None or source not in source_to_indices:
         return
+    keep = [i for i, m in enumerate(metadatas) if m["source"] != source]
+    if keep:
+        # The index types used here cannot delete single entries, so the stored
+        # vectors of the remaining chunks are re-indexed without calling Ollama
+        source_index = index
+        if isinstance(source_index, faiss.IndexIVF):
+            # make_direct_map changes the index, which may be searched meanwhile
+            source_index = faiss.clone_index(source_index)
+            source_index.make_direct_map()
+        vectors = np.ascontiguousarray(source_index.reconstruct_n(0, source_index.ntotal)[keep])
+        new_index = create_faiss_index(vectors)
+    else:
+        new_index = None
+    publish_index_state(new_index,
+                        [metadatas[i] for i in keep],
+                        [all_chunks[i] for i in keep],
+                        [chunk_token_counts[i] for i in keep])
+
+    if index is not None:
+        save_faiss_index()
+    else:
+        for path in INDEX_FILES:
+            if os.path.exists(path):
+                os.remove(path)
 
-    embeddings = embed_via_ollama(all_chunks)
-    embs       = np.array(embeddings, dtype="float32")
+def build_faiss_index(extracted_contents_by_file: dict[str, str],
+                      max_tokens_per_chunk: int = 1024) -> None:
+    chunks, ntoks, metas = chunk_files(extracted_contents_by_file, max_tokens_per_chunk)
 
-    if embs.ndim == 1:
-        embs = embs.reshape(1, -1)
+    if not chunks:
+        logging.warning("No chunks found – FAISS index will not be created.")
+        publish_index_state(None, metas, chunks, ntoks)
+        return
 
-    all_embeddings = embs
+    publish_index_state(create_faiss_index(embed_via_ollama(chunks)), metas, chunks, ntoks)
+    save_faiss_index()
 
-    index = faiss.IndexFlatL2(embs.shape[1])
-    index.add(embs)
+def ingest_new_files(extracted_contents_by_file: dict[str, str],
+                     max_tokens_per_chunk: int = 1024) -> None:
+    if index is None:
+        build_faiss_index(extracted_contents_by_file, max_tokens_per_chunk)
+        return
 
-    faiss.write_index(index, "rag_index.faiss")
-    with open("rag_meta.json", "w", encoding="utf-8") as f:
-        json.dump(metadatas, f, ensure_ascii=False, indent=2)
+    new_files = {fname: text for fname, text in extracted_contents_by_file.items()
+                 if fname not in source_to_indices}
+    new_chunks, new_ntoks, new_metas = chunk_files(new_files, max_tokens_per_chunk)
+    if not new_chunks:
+        return
 
-    with open("rag_chunks.json", "w", encoding="utf-8") as f:
-        json.dump(all_chunks, f, ensure_ascii=False, indent=2)
+    # Only the new chunks are embedded; quantizer and graph trained on earlier data
+    # are kept. They are added to a copy because the current index may be searched meanwhile
+    new_index = faiss.clone_index(index)
+    set_search_params(new_index)
+    new_index.add(prepare_vectors(new_index, embed_via_ollama(new_chunks)))
+    publish_index_state(new_index, metadatas + new_metas,
+                        all_chunks + new_chunks, chunk_token_counts + new_ntoks)
+    save_faiss_index()
 
 def extract_text_from_pdf(file):
-    text = ""
-    pdf_data = file.read()
+    return extract_text_from_pdf_bytes(file.read())
+
+def extract_text_from_pdf_bytes(pdf_data):
     try:
         with fitz.open(stream=pdf_data, filetype="pdf") as pdf:
-            for page in pdf:
-                text += page.get_text()
+            text = "".join([page.get_text("text") for page in pdf])
     except Exception as e:
         logging.debug("Error reading PDF: %s", str(e))
         return f"Error reading PDF: {str(e)}"
-    cleaned_text = re.sub(r'\s*\n\s*', ' ', text)
-    cleaned_text = re.sub(r'\s{2,}', ' ', cleaned_text)
-    return cleaned_text.strip()
+    return _WS.sub(' ', text).strip()
+
+def fetch_readable_contents(urls):
+    urls = list(urls)
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(URL_WORKERS, len(urls))) as executor:
+        return list(executor.map(get_readable_content, urls))
 
 def extract_content(url_input, pdf_files):
     all_content = ""
     if url_input:
         urls = [url.strip() for url in url_input.split(",")]
-        for url in urls:
-            if url.startswith("http"):
-                all_content += get_readable_content(url) + "\n"
-    if pdf_files:
-        for pdf_file in pdf_files:
-            pdf_text = extract_text_from_pdf(pdf_file)
+        for url_content in fetch_readable_contents(url for url in urls if url.startswith("http")):
+            all_content += url_content + "\n"
+    if pdf_files and len(pdf_files) == 1:
+        all_content += extract_text_from_pdf(pdf_files[0]) + "\n"
+    elif pdf_files:
+        # PyMuPDF is not thread-safe and FileStorage objects are not picklable,
+        # so the bytes are read here and parsed in worker processes
+        pdf_datas = [pdf_file.read() for pdf_file in pdf_files]
+        try:
+            with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(pdf_datas))) as executor:
+                pdf_texts = list(executor.map(extract_text_from_pdf_bytes, pdf_datas))
+        except Exception as e:
+            logging.debug("PDF worker pool failed, parsing in process: %s", str(e))
+            pdf_texts = [extract_text_from_pdf_bytes(pdf_data) for pdf_data in pdf_datas]
+        for pdf_text in pdf_texts:
             all_content += pdf_text + "\n"
     content = all_content.strip() or "No content extracted from the provided inputs."
     logging.debug("Extracted content: %s", content)
@@ -280,11 +515,9 @@ def perform_internet_search_multiple(query, num_results=3):
         with DDGS() as ddgs:
             results = ddgs.text(query, max_results=10)
         logging.debug("Found %d search results", len(results) if results else 0)
-        for i in range(1, min(num_results + 1, len(results))):
-            result = results[i]
-            link = result.get("href") or result.get("url", "")
+        links = [result.get("href") or result.get("url", "") for result in results[1:num_results + 1]]
+        for i, (link, content) in enumerate(zip(links, fetch_readable_contents(links)), start=1):
             logging.debug("Using search result %d URL: %s", i + 1, link)
-            content = get_readable_content(link)
             if content and len(content) > 100:
                 contents.append(content)
                 logging.debug("Extracted content from result %d (first 200 chars): %s", i + 1, content[:200])
@@ -298,17 +531,24 @@ def summarise_text(text):
     prompt = f"Summarize the following text in a few sentences.:\n\n{text}"
     return query_llama_via_cli(prompt)
 
+def map_llm_calls(func, items):
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(LLM_WORKERS, len(items))) as executor:
+        return list(executor.map(func, items))
+
 def generate_combined_response(competence_level, web_contents, user_question):
     if not competence_level or not user_question.strip():
         return "Please select a skill level and enter a question."
     
-    summarized_contents = []
-    for content in web_contents:
-        if len(tokenize_text(content)) > 1000:  
-            summary = summarise_text(content)
-            summarized_contents.append(summary)
-        else:
-            summarized_contents.append(content)
+    def summarise_if_long(content):
+        # A BPE token covers at least one byte, so short texts need no encoding pass
+        if len(content.encode("utf-8")) > 1000 and len(tokenize_text(content)) > 1000:
+            return summarise_text(content)
+        return content
+
+    summarized_contents = map_llm_calls(summarise_if_long, web_contents)
     
     combined_content = "\n\n---\n\n".join(summarized_contents)
     prompt = f"System: You are an intelligent assistant. Please summarize the following information and then answer the question.\n\nInformations:\n{combined_content}\n\nQuestion: {user_question}"
@@ -316,48 +556,64 @@ def generate_combined_response(competence_level, web_contents, user_question):
     return response
 
 def query_llama_via_cli(input_text, selected_model="llama3.2:latest"):
+    payload = {
+        "model": selected_model,
+        "prompt": input_text,
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE
+    }
     try:
-        result = subprocess.run(
-            ["ollama", "run", selected_model],
-            input=f"{input_text}\n",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            timeout=60 
-        )
-        if result.returncode != 0:
-            logging.debug("Model error: %s", result.stderr.strip())
-            return f"Error in the model request: {result.stderr.strip()}"
-        response = re.sub(r'\x1b\[.*?m', '', result.stdout)
-        return response.strip()
-    except subprocess.TimeoutExpired:
+        resp = ollama_session.post(f"{OLLAMA_BASE}/generate", json=payload, timeout=60)
+        resp.raise_for_status()
+        return resp.json()["response"].strip()
+    except requests.exceptions.Timeout:
         logging.debug("Model request timed out.")
         return "The model request timed out. Please try again."
+    except requests.exceptions.RequestException as e:
+        logging.debug("Model error: %s", str(e))
+        return f"Error in the model request: {str(e)}"
     except Exception as e:
         logging.debug("Unexpected error during model request: %s", str(e))
         return f"An unexpected error has occurred: {str(e)}"
 
-def select_relevant_chunks(chunks, question, threshold=0.5):
+def warm_up_models(selected_model="llama3.2:latest"):
+    # An empty prompt only loads the model, so the first question skips the cold start
+    try:
+        ollama_session.post(f"{OLLAMA_BASE}/generate",
+                            json={"model": selected_model, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+                            timeout=300).raise_for_status()
+        embed_batch_via_ollama(["warm-up"])
+    except requests.exceptions.RequestException as e:
+        logging.debug("Model warm-up failed: %s", str(e))
+
+def select_relevant_chunks(question, sources, top_k=RAG_TOP_K, max_distance=None):
+    index, metadatas, all_chunks, chunk_token_counts, _ = index_state_snapshot()
+    if index is None or index.ntotal == 0:
+        return []
+    q_emb = prepare_vectors(index, embed_query(question))
+    # Over-fetch because hits from sources that are not selected are dropped
+    distances, ids = index.search(q_emb, min(index.ntotal, top_k * 4))
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        # For unit vectors the squared L2 distance is 2 - 2 * cosine similarity
+        distances = 2 - 2 * distances
+
     relevant = []
-    for i, chunk in enumerate(chunks):
-        prompt = (
-            f"System: You are a helper.\n"
-            f"Question: {question}\n\n"
-            f"Section #{i+1}:\n{chunk}\n\n"
-            "Is this section RELEVANT to answering the question?"
-            "Answer only with 'yes' or 'no'."
-        )
-        resp = query_llama_via_cli(prompt).lower()
-        if resp.startswith("ja"):
-            relevant.append(chunk)
+    for dist, i in zip(distances[0], ids[0]):
+        if i < 0 or metadatas[i]["source"] not in sources:
+            continue
+        if max_distance is not None and dist > max_distance:
+            continue
+        src    = metadatas[i]["source"]
+        header = f"### source: {src}\n"
+        relevant.append((src, header + all_chunks[i], len(tokenize_text(header)) + chunk_token_counts[i]))
+        if len(relevant) == top_k:
+            break
     return relevant
 
 def select_chunks_within_budget(chunks, max_tokens):
     selected = []
     total = 0
-    for chunk in chunks:
-        tok = len(tokenize_text(chunk))
+    for chunk, tok in chunks:
         if total + tok > max_tokens:
             break
         selected.append(chunk)
@@ -369,31 +625,21 @@ def generate_responses_from_blocks(competence_level, extracted_contents_by_file,
         return "Please select a skill level and enter a question."
 
     chunk_size = 4096
-    chunks = []
-    for fname, text in extracted_contents_by_file.items():
-        header = f"### Source: {fname}\n"
-        for block in split_text_into_blocks(header + text, chunk_size):
-            chunks.append(block)
-
-    all_relevant = []
+    hits          = select_relevant_chunks(user_question, set(extracted_contents_by_file))
+    all_relevant  = [(chunk, ntok) for _, chunk, ntok in hits]
+    found_sources = {src for src, _, _ in hits}
     for fname, text in extracted_contents_by_file.items():
+        if fname in found_sources:
+            continue
+        # Sources without a search hit still contribute their opening section
         header = f"### source: {fname}\n"
-        source_chunks = list(split_text_into_blocks(header + text, chunk_size))
-
-        rel = select_relevant_chunks(source_chunks, user_question)
-        if not rel:
-            rel = [source_chunks[0]]
-        all_relevant.extend(rel)
+        first_ids = tokenize_text(header + text)[:chunk_size]
+        all_relevant.append((detokenize_text(first_ids), len(first_ids)))
 
     selected_chunks = select_chunks_within_budget(all_relevant, token_limit)
     combined_context = "\n\n---\n\n".join(selected_chunks)
 
-    if competence_level == "Beginner":
-        level_instr = "answer briefly and simply"
-    elif competence_level == "Intermediate":
-        level_instr = "answer in a balanced manner at a moderate level"
-    else:
-        level_instr = "explain in detail at an advanced level"
+    level_instr = LEVEL_INSTRUCTIONS.get(competence_level, DEFAULT_LEVEL_INSTRUCTION)
 
     prompt = (
         f"System: You are an intelligent assistant. {level_instr}. "
@@ -413,19 +659,14 @@ def generate_from_multiple_sources(competence_level, extracted_contents_by_file,
     if not competence_level or not user_question.strip():
         return "Please select a skill level and enter a question."
 
-    summaries = []
-    for fname, text in extracted_contents_by_file.items():
-        summary = summarise_text(text)
-        summaries.append(f"### Summary {fname}:\n{summary}")
+    fnames    = list(extracted_contents_by_file)
+    texts     = [extracted_contents_by_file[fname] for fname in fnames]
+    summaries = [f"### Summary {fname}:\n{summary}"
+                 for fname, summary in zip(fnames, map_llm_calls(summarise_text, texts))]
 
     merged = "\n\n---\n\n".join(summaries)
 
-    if competence_level == "Beginner":
-        level_instr = "answer briefly and simply"
-    elif competence_level == "Intermediate":
-        level_instr = "answer in a balanced manner at a moderate level"
-    else:
-        level_instr = "explain in detail at an advanced level"
+    level_instr = LEVEL_INSTRUCTIONS.get(competence_level, DEFAULT_LEVEL_INSTRUCTION)
 
     prompt = (
         f"System: You are an intelligent assistant. {level_instr}. "
@@ -502,6 +743,7 @@ HTML_CONTENT = """
         <button id="extract-btn">Extract content</button>
         <button id="show-extractions-btn" style="display:none;">Show content</button>
       </div>
+      <progress id="upload-progress" class="upload-progress" max="100" value="0" style="display:none;"></progress>
       
       <div id="extractions-overview" style="display:none; margin-top:20px;">
         <ul id="extractions-list">
@@ -636,6 +878,12 @@ button:hover {
   padding-right: 8px;
   scrollbar-gutter: stable;
 }
+.upload-progress {
+  width: 100%;
+  height: 8px;
+  margin-top: 10px;
+  accent-color: #00B0F0;
+}
 .spinner {
   border: 8px solid #262626;
   border-top: 8px solid #00B0F0;
@@ -747,6 +995,8 @@ button:hover {
 .chat-message {
   display: flex;
   align-items: flex-start;
+  content-visibility: auto;
+  contain-intrinsic-size: auto 80px;
 }
 .chat-message.user .bubble {
   background: #00B0F0;
@@ -807,6 +1057,7 @@ document.addEventListener('DOMContentLoaded', function() {
   const questionInput = document.getElementById('question-input');
   const responseDiv = document.getElementById('response');
   const spinner = document.getElementById('spinner');
+  const uploadProgress = document.getElementById('upload-progress');
   const competenceButtons = document.querySelectorAll('.competence-button');
   const showBtn = document.getElementById('show-extractions-btn');
   const overview = document.getElementById('extractions-overview');
@@ -823,7 +1074,21 @@ document.addEventListener('DOMContentLoaded', function() {
 
   let selectedCompetence = "Intermediate";
   let currentExtractionFilename = null;
-  let messages = [];
+  const selectedExtractions = new Set();
+  const MAX_MESSAGES = 20;
+  const messages = [];
+  const renderedNodes = [];
+  const md = markdownit();
+
+  let cachedVoice = null;
+  function cacheVoice() {
+    cachedVoice = speechSynthesis.getVoices().find(v => v.name.includes('Microsoft')) || null;
+  }
+  // Voices load asynchronously in some browsers, so the lookup is repeated when the list changes
+  if ('speechSynthesis' in window) {
+    cacheVoice();
+    speechSynthesis.onvoiceschanged = cacheVoice;
+  }
 
   let conversationId = localStorage.getItem('conversationId');
   if (!conversationId) {
@@ -859,8 +1124,8 @@ document.addEventListener('DOMContentLoaded', function() {
     spinner.style.display = 'block';
 
     try {
-      const res  = await fetch('/extract_content', { method: 'POST', body: formData });
-      const text = await res.text();
+      const text = await uploadWithProgress('/extract_content', formData);
+      uploadProgress.style.display = 'none';
       console.log('Raw /extract_content response:', text);
       const data = JSON.parse(text);
       spinner.style.display = 'none';
@@ -876,11 +1141,28 @@ document.addEventListener('DOMContentLoaded', function() {
       }
     } catch (err) {
       spinner.style.display = 'none';
+      uploadProgress.style.display = 'none';
       console.error("Parsing or network error:", err);
       alert("Error during extraction. Check the console.");
     }
   });
 
+  function uploadWithProgress(url, formData) {
+    // All files go up in one multipart request; XHR is used because fetch reports no upload progress
+    return new Promise((resolve, reject) => {
+      const xhr = new XMLHttpRequest();
+      xhr.open('POST', url);
+      xhr.upload.addEventListener('progress', e => {
+        if (!e.lengthComputable) return;
+        uploadProgress.style.display = 'block';
+        uploadProgress.value = Math.round(e.loaded / e.total * 100);
+      });
+      xhr.onload  = () => resolve(xhr.responseText);
+      xhr.onerror = () => reject(new Error('Network error during upload'));
+      xhr.send(formData);
+    });
+  }
+
   competenceButtons.forEach(button => {
     button.addEventListener('click', function() {
       competenceButtons.forEach(btn => btn.classList.remove('selected'));
@@ -892,27 +1174,22 @@ document.addEventListener('DOMContentLoaded', function() {
   pdfDropZone.addEventListener('dragover', function(e) {
     e.preventDefault();
     e.stopPropagation();
-    pdfDropZone.classList.add('dragover');
-  });
+    if (!pdfDropZone.classList.contains('dragover')) pdfDropZone.classList.add('dragover');
+  }, { passive: false });
   
   pdfDropZone.addEventListener('dragleave', function(e) {
-    e.preventDefault();
     e.stopPropagation();
     pdfDropZone.classList.remove('dragover');
-  });
+  }, { passive: true });
   
   pdfDropZone.addEventListener('drop', function(e) {
     e.preventDefault();
     e.stopPropagation();
     pdfDropZone.classList.remove('dragover');
-    let dt = e.dataTransfer;
-    let files = dt.files;
+    const files = e.dataTransfer.files;
     if (files.length > 0) {
-      let dataTransfer = new DataTransfer();
-      for (let i = 0; i < files.length; i++) {
-        dataTransfer.items.add(files[i]);
-      }
-      pdfInput.files = dataTransfer.files;
+      // A drop replaces the selection, so the dropped FileList can be assigned as is
+      pdfInput.files = files;
       updatePdfFilenameDisplay();
       updatePdfUploadButton();
     }
@@ -939,27 +1216,33 @@ document.addEventListener('DOMContentLoaded', function() {
     for (let i = 0; i < pdfInput.files.length; i++) {
       fileNames.push(pdfInput.files[i].name);
     }
-    pdfFilename.innerText = fileNames.join(', ');
+    pdfFilename.textContent = fileNames.join(', ');
   }
 
   function updatePdfUploadButton() {
     if (pdfInput.files.length > 0) {
-      pdfUploadBtn.innerText = "Delete files";
+      pdfUploadBtn.textContent = "Delete files";
     } else {
-      pdfUploadBtn.innerText = "Upload PDF files";
+      pdfUploadBtn.textContent = "Upload PDF files";
     }
   }
 
+  let inFlight = false;
+  // ANSI colour codes and zero-width characters, stripped from answers in one pass
+  const CLEANUP_RE = /\x1b\[[0-9;]*m|[\u200B-\u200D\uFEFF]/g;
+
   askBtn.addEventListener('click', async function() {
     const question = questionInput.value.trim();
-    if (!question) return;
+    if (!question || inFlight) return;
+    // One question at a time; repeated clicks would start duplicate LLM and TTS work
+    inFlight = true;
+    askBtn.disabled = true;
 
     addMessage('user', question);
     questionInput.value = '';
     spinner.style.display = 'block';
 
-    const checkedBoxes  = document.querySelectorAll('.extraction-checkbox:checked');
-    const selectedFiles = Array.from(checkedBoxes).map(cb => cb.dataset.filename);
+    const selectedFiles = Array.from(selectedExtractions);
 
     try {
       const res  = await fetch('/ask_question', {
@@ -976,15 +1259,16 @@ document.addEventListener('DOMContentLoaded', function() {
       const data = await res.json();
       spinner.style.display = 'none';
 
-      const cleaned = data.response
-        .replace(/\x1b\[[0-9;]*m/g, '')
-        .replace(/[\u200B-\u200D\uFEFF]/g, '');
+      const cleaned = data.response.replace(CLEANUP_RE, '');
 
-      addMessage('bot', cleaned, data.audio_url);
+      addMessage('bot', cleaned, data.audio_url, data.tts_ready_url);
     } catch (error) {
       spinner.style.display = 'none';
       console.error("Fehler:", error);
       alert("Error when asking the question.");
+    } finally {
+      inFlight = false;
+      askBtn.disabled = false;
     }
   });
 
@@ -1028,11 +1312,53 @@ document.addEventListener('DOMContentLoaded', function() {
       });
   });
 
+  // One pair of listeners on the list handles every row, however often it is rebuilt
+  list.addEventListener('change', e => {
+    const cb = e.target;
+    if (!cb.matches('.extraction-checkbox')) return;
+    if (cb.checked) selectedExtractions.add(cb.dataset.filename);
+    else selectedExtractions.delete(cb.dataset.filename);
+  });
+
+  list.addEventListener('click', e => {
+    const li = e.target.closest('.result-container');
+    if (!li || e.target.matches('.extraction-checkbox')) return;
+    const filename = li.dataset.filename;
+
+    if (e.target.matches('.delete-btn')) {
+      fetch(`/delete_extraction/${encodeURIComponent(filename)}`, { method: 'DELETE' })
+        .then(r => {
+          if (!r.ok) throw new Error('Deletion failed');
+          return r.json();
+        })
+        .then(() => {
+          alert('File successfully deleted.');
+          refreshExtractionList();
+        })
+        .catch(err => {
+          console.error(err);
+          alert('Error during deletion: ' + err.message);
+        });
+      return;
+    }
+
+    currentExtractionFilename = filename;
+    fetch(`/get_extraction/${encodeURIComponent(filename)}`)
+      .then(r => r.ok ? r.text() : r.json().then(data => data.error))
+      .then(text => {
+        overview.style.display    = 'none';
+        detail.style.display      = 'block';
+        detailContent.textContent = text;
+      });
+  });
+
   function refreshExtractionList() {
     fetch('/list_extractions')
       .then(r => r.json())
       .then(files => {
         list.innerHTML = '';
+        selectedExtractions.clear();
+        const frag = document.createDocumentFragment();
 
         if (files.length) {
           overview.style.display   = 'block';
@@ -1048,14 +1374,12 @@ document.addEventListener('DOMContentLoaded', function() {
         files.forEach(f => {
           const li = document.createElement('li');
           li.classList.add('result-container');
+          li.dataset.filename = f.name;
 
           const cb = document.createElement('input');
           cb.type = 'checkbox';
           cb.classList.add('extraction-checkbox');
           cb.dataset.filename = f.name;
-          cb.addEventListener('click', e => {
-            e.stopPropagation();
-          });
 
           const label = document.createElement('span');
           label.textContent = ` ${f.name} (${f.date})`;
@@ -1063,136 +1387,130 @@ document.addEventListener('DOMContentLoaded', function() {
           const del = document.createElement('button');
           del.textContent = 'Delete';
           del.classList.add('delete-btn');
-          del.addEventListener('click', e => {
-            e.stopPropagation();
-            fetch(`/delete_extraction/${encodeURIComponent(f.name)}`, { method: 'DELETE' })
-              .then(r => {
-                if (!r.ok) throw new Error('Deletion failed');
-                return r.json();
-              })
-              .then(() => {
-                alert('File successfully deleted.');
-                refreshExtractionList();
-              })
-              .catch(err => {
-                console.error(err);
-                alert('Error during deletion: ' + err.message);
-              });
-          });
 
           li.append(cb, label, del);
-
-          li.addEventListener('click', () => {
-            currentExtractionFilename = f.name;
-            fetch(`/get_extraction/${encodeURIComponent(f.name)}`)
-              .then(r => r.json())
-              .then(data => {
-                overview.style.display    = 'none';
-                detail.style.display      = 'block';
-                detailContent.textContent = data.content || data.error;
-              });
-          });
-
-          list.appendChild(li);
+          frag.appendChild(li);
         });
+        list.appendChild(frag);
 
-        if (overview.scrollHeight > overview.clientHeight) {
-          overview.style.paddingRight = '16px';
-        } else {
-          overview.style.paddingRight = '0';
-        }
+        // Measured after the next layout instead of forcing one right after the insert
+        requestAnimationFrame(() => {
+          if (overview.scrollHeight > overview.clientHeight) {
+            overview.style.paddingRight = '16px';
+          } else {
+            overview.style.paddingRight = '0';
+          }
+        });
       })
       .catch(err => {
         console.error('Error loading the extraction list:', err);
       });
   }
 
-  function addMessage(role, text, audioUrl = null) {
-    messages.push({ role, text, audioUrl });
-    if (messages.length > 20) messages = messages.slice(-20);
-    renderChat();
+  async function waitForAudio(readyUrl) {
+    // The server renders the MP3 in the background; poll until it is on disk
+    for (let attempt = 0; attempt < 60; attempt++) {
+      const res = await fetch(readyUrl);
+      if (res.status === 200) return true;
+      if (res.status !== 202) return false;
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+    return false;
   }
 
-  function renderChat() {
-    if (messages.length > 0) {
-      chatSection.style.display = 'block';
-    } else {
-      chatSection.style.display = 'none';
-      return;
+  function addMessage(role, text, audioUrl = null, ttsReadyUrl = null) {
+    const msg = { role, text, audioUrl, ttsReadyUrl, html: DOMPurify.sanitize(md.render(text)) };
+    if (messages.length >= MAX_MESSAGES) {
+      // The oldest message and its bubble are dropped in place; the rest stays rendered
+      messages.shift();
+      renderedNodes.shift().remove();
     }
+    messages.push(msg);
+    if (messages.length === 1) chatSection.style.display = 'block';
+    appendMessageNode(msg);
+  }
+
+  function appendMessageNode(msg) {
+    const wrapper = buildMessageNode(msg);
+    renderedNodes.push(wrapper);
+    chatContainer.appendChild(wrapper);
+    chatContainer.scrollTop = chatContainer.scrollHeight;
+  }
 
-    chatContainer.innerHTML = '';
-    messages.forEach((msg) => {
-      const wrapper = document.createElement('div');
-      wrapper.classList.add('chat-message', msg.role);
+  function buildMessageNode(msg) {
+    const wrapper = document.createElement('div');
+    wrapper.classList.add('chat-message', msg.role);
 
-      const bubble = document.createElement('div');
-      bubble.classList.add('bubble');
+    const bubble = document.createElement('div');
+    bubble.classList.add('bubble');
 
-      const label = document.createElement('strong');
-      label.textContent = msg.role === 'user' ? 'Me: ' : 'KI: ';
-      label.style.marginRight = '6px';
+    const label = document.createElement('strong');
+    label.textContent = msg.role === 'user' ? 'Me: ' : 'KI: ';
+    label.style.marginRight = '6px';
 
-      const content = DOMPurify.sanitize(markdownit().render(msg.text));
-      bubble.innerHTML = content;
-      bubble.prepend(label);
+    bubble.innerHTML = msg.html;
+    bubble.prepend(label);
 
-      if (msg.role === 'bot' && msg.audioUrl) {
-        const ttsBtn = document.createElement('span');
-        ttsBtn.classList.add('tts-control');
-        ttsBtn.innerHTML = playIcon; 
-        bubble.appendChild(ttsBtn);
+    if (msg.role === 'bot' && msg.audioUrl) {
+      const ttsBtn = document.createElement('span');
+      ttsBtn.classList.add('tts-control');
+      ttsBtn.innerHTML = playIcon; 
+      bubble.appendChild(ttsBtn);
 
-        const audio = document.createElement('audio');
-        audio.src = msg.audioUrl;
-        audio.preload = 'none';
+      // Most answers are never played, so the <audio> element is only created on first click
+      let audio = null;
 
-        ttsBtn.addEventListener('click', () => {
-          if (audio.paused) {
-            audio.play();
-            ttsBtn.innerHTML = pauseIcon;
-          } else {
-            audio.pause();
-            ttsBtn.innerHTML = playIcon;
+      ttsBtn.addEventListener('click', async () => {
+        if (!audio || audio.paused) {
+          if (msg.ttsReadyUrl) {
+            if (!await waitForAudio(msg.ttsReadyUrl)) return;
+            msg.ttsReadyUrl = null;
           }
-        });
-
-        audio.addEventListener('ended', () => {
+          if (!audio) {
+            audio = document.createElement('audio');
+            audio.preload = 'none';
+            audio.src = msg.audioUrl;
+            audio.addEventListener('ended', () => {
+              ttsBtn.innerHTML = playIcon;
+            });
+          }
+          audio.play();
+          ttsBtn.innerHTML = pauseIcon;
+        } else {
+          audio.pause();
           ttsBtn.innerHTML = playIcon;
-        });
+        }
+      });
 
-      } else if (msg.role === 'bot' && !msg.audioUrl) {
-        const ttsBtn = document.createElement('span');
-        ttsBtn.classList.add('tts-control');
-        ttsBtn.innerHTML = playIcon;
-        let utterance = null;
-
-        ttsBtn.addEventListener('click', () => {
-          if (!utterance) {
-            utterance = new SpeechSynthesisUtterance(msg.text);
-            const voice = speechSynthesis.getVoices().find(v => v.name.includes('Microsoft'));
-            if (voice) utterance.voice = voice;
-            speechSynthesis.speak(utterance);
-            ttsBtn.innerHTML = pauseIcon;
-            utterance.onend = () => {
-              ttsBtn.innerHTML = playIcon;
-              utterance = null;
-            };
-          } else if (speechSynthesis.paused) {
-            speechSynthesis.resume();
-            ttsBtn.innerHTML = pauseIcon;
-          } else {
-            speechSynthesis.pause();
+    } else if (msg.role === 'bot' && !msg.audioUrl) {
+      const ttsBtn = document.createElement('span');
+      ttsBtn.classList.add('tts-control');
+      ttsBtn.innerHTML = playIcon;
+      let utterance = null;
+
+      ttsBtn.addEventListener('click', () => {
+        if (!utterance) {
+          utterance = new SpeechSynthesisUtterance(msg.text);
+          if (cachedVoice) utterance.voice = cachedVoice;
+          speechSynthesis.speak(utterance);
+          ttsBtn.innerHTML = pauseIcon;
+          utterance.onend = () => {
             ttsBtn.innerHTML = playIcon;
-          }
-        });
-        bubble.appendChild(ttsBtn);
-      }
+            utterance = null;
+          };
+        } else if (speechSynthesis.paused) {
+          speechSynthesis.resume();
+          ttsBtn.innerHTML = pauseIcon;
+        } else {
+          speechSynthesis.pause();
+          ttsBtn.innerHTML = playIcon;
+        }
+      });
+      bubble.appendChild(ttsBtn);
+    }
 
-      wrapper.appendChild(bubble);
-      chatContainer.appendChild(wrapper);
-    });
-    chatContainer.scrollTop = chatContainer.scrollHeight;
+    wrapper.appendChild(bubble);
+    return wrapper;
   }
 
   refreshExtractionList();
@@ -1214,21 +1532,34 @@ def script():
 @app.route('/conversations/<conv_id>/<filename>')
 def serve_conv_audio(conv_id, filename):
     directory = os.path.join(CONV_ROOT, conv_id)
+    if os.path.join(directory, filename) in tts_jobs:
+        # Still being rendered in the background
+        return Response(status=202, headers={"Retry-After": "1"})
     return send_from_directory(directory, filename)
 
+@app.route('/tts_ready/<conv_id>/<filename>')
+def tts_ready(conv_id, filename):
+    path = os.path.join(CONV_ROOT, secure_filename(conv_id), secure_filename(filename))
+    if os.path.exists(path):
+        return jsonify({"ready": True})
+    if path in tts_jobs:
+        return jsonify({"ready": False}), 202
+    return jsonify({"ready": False}), 404
+
+MODELS_CACHE_TTL = 30
+_models_cache = {"at": 0, "data": None}
+
 @app.route('/list_models', methods=['GET'])
 def list_models():
+    if _models_cache["data"] is not None and time.time() - _models_cache["at"] < MODELS_CACHE_TTL:
+        return jsonify(_models_cache["data"])
     try:
-        result = subprocess.run(['ollama', 'list'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode != 0:
-            return jsonify({"error": result.stderr.strip()}), 500
-        lines = result.stdout.strip().split('\n')
-        models = []
-        for line in lines[1:]:
-            parts = line.split()
-            if parts:
-                models.append(parts[0])
+        resp = ollama_session.get(f"{OLLAMA_BASE}/tags", timeout=10)
+        resp.raise_for_status()
+        models = [m["name"] for m in resp.json().get("models", [])]
         models = [m for m in models if not m.startswith("nomic-embed-text")]
+        _models_cache["data"] = models
+        _models_cache["at"] = time.time()
         return jsonify(models)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1253,26 +1584,28 @@ def extract_content_endpoint():
     default_msg = "No content extracted from the provided inputs."
     if extracted.strip() and extracted.strip() != default_msg:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename  = os.path.join(DATA_DIR, f"extraction_{timestamp}.txt")
+        # The suffix keeps two extractions within the same second from sharing a file
+        filename  = os.path.join(DATA_DIR, f"extraction_{timestamp}_{uuid.uuid4().hex[:8]}.txt")
         with open(filename, "w", encoding="utf-8") as f:
             f.write(extracted)
+        invalidate_extractions_cache()
 
-        all_files = {}
-        for fname in os.listdir(DATA_DIR):
-            if not fname.endswith(".txt"):
-                continue
-            path = os.path.join(DATA_DIR, fname)
-            with open(path, encoding="utf-8") as f2:
-                all_files[fname] = f2.read()
+        with index_lock:
+            # Files that are already in the index are not read again
+            new_files = {}
+            for fname in os.listdir(DATA_DIR):
+                if not fname.endswith(".txt") or fname in source_to_indices:
+                    continue
+                path = os.path.join(DATA_DIR, fname)
+                with open(path, encoding="utf-8") as f2:
+                    new_files[fname] = f2.read()
 
-        build_faiss_index(all_files)
+            ingest_new_files(new_files)
 
     return jsonify({ "content": extracted or "" })
 
 @app.route('/ask_question', methods=['POST'])
 def ask_question():
-    global metadatas, all_chunks, all_embeddings
-
     data            = request.get_json()
     conv_id         = data.get("conversation_id")
     competence      = data.get("competence_level")
@@ -1283,20 +1616,20 @@ def ask_question():
     if not selected_files:
         return jsonify({"response": "Please select at least one source."})
 
+    _, _, all_chunks, _, source_to_indices = index_state_snapshot()
     source_contents = {}
     for src in selected_files:
         content_blocks = []
-        src_idx = [i for i, m in enumerate(metadatas) if m["source"] == src]
+        src_idx = source_to_indices.get(src, [])
         for i in src_idx:
             content_blocks.append(all_chunks[i])
         source_contents[src] = "\n\n".join(content_blocks[:5])  
 
-    per_source_answers = []
-    for src, content in source_contents.items():
-        if not content.strip():
-            continue
-        ans = answer_per_source(competence, src, content, question, selected_model)
-        per_source_answers.append(f"**Answer for {src}:**\n{ans.strip()}")
+    sources = [(src, content) for src, content in source_contents.items() if content.strip()]
+    answers = map_llm_calls(
+        lambda item: answer_per_source(competence, item[0], item[1], question, selected_model), sources)
+    per_source_answers = [f"**Answer for {src}:**\n{ans.strip()}"
+                          for (src, _), ans in zip(sources, answers)]
 
     if not per_source_answers:
         return jsonify({"response": "No relevant content found."})
@@ -1313,6 +1646,7 @@ def ask_question():
 
     tts_fname = generate_tts_conv(final_answer, conv_id)
     audio_url = url_for('serve_conv_audio', conv_id=conv_id, filename=tts_fname)
+    tts_ready_url = url_for('tts_ready', conv_id=conv_id, filename=tts_fname)
     append_to_log(conv_id, {
         "timestamp": datetime.utcnow().isoformat()+"Z",
         "question":  question,
@@ -1324,6 +1658,7 @@ def ask_question():
     return jsonify({
         "response":  final_answer,
         "audio_url": audio_url,
+        "tts_ready_url": tts_ready_url,
         "per_source_answers": per_source_answers 
     })
 
@@ -1331,8 +1666,18 @@ def ask_question():
 def clear_extracted():
     return jsonify({"content": ""})
 
+_extractions_cache = {"mtime": None, "files": None}
+
+def invalidate_extractions_cache():
+    _extractions_cache["mtime"] = None
+
 @app.route('/list_extractions', methods=['GET'])
 def list_extractions():
+    # The directory mtime changes whenever a file is added or removed, also from outside the app
+    dir_mtime = os.stat(DATA_DIR).st_mtime_ns
+    if _extractions_cache["mtime"] == dir_mtime:
+        return jsonify(_extractions_cache["files"])
+
     files = []
     for fname in sorted(os.listdir(DATA_DIR), reverse=True):
         if fname.endswith(".txt"):
@@ -1342,6 +1687,8 @@ def list_extractions():
                 "name": fname,
                 "date": mtime.strftime("%Y-%m-%d %H:%M:%S")
             })
+    _extractions_cache["files"] = files
+    _extractions_cache["mtime"] = dir_mtime
     return jsonify(files)
 
 @app.route('/get_extraction/<filename>', methods=['GET'])
@@ -1349,8 +1696,7 @@ def get_extraction(filename):
     safe = secure_filename(filename)
     path = os.path.join(DATA_DIR, safe)
     if os.path.isfile(path):
-        with open(path, encoding="utf-8") as f:
-            return jsonify({"content": f.read()})
+        return send_from_directory(DATA_DIR, safe, mimetype='text/plain')
     return jsonify({"error": "Not found"}), 404
 
 @app.route('/delete_extraction/<filename>', methods=['DELETE'])
@@ -1358,11 +1704,15 @@ def delete_extraction(filename):
     safe = secure_filename(filename)
     path = os.path.join(DATA_DIR, safe)
     if os.path.isfile(path):
-        os.remove(path)
+        with index_lock:
+            os.remove(path)
+            drop_source_from_index(safe)
+        invalidate_extractions_cache()
         return jsonify({"status": "deleted"})
     return jsonify({"error": "Not found"}), 404
 
 if __name__ == '__main__':
     load_faiss_index() 
+    threading.Thread(target=warm_up_models, daemon=True).start()
     app.run(debug=True, host="0.0.0.0", port=5000)
 
@@ -0,0 +1,20 @@
+"""
+WSGI entry point for IEC V1.5, e.g.:
+gunicorn -w 2 -k gthread --threads 16 --timeout 300 -b 0.0.0.0:5000 wsgi:app
+"""
+
+import importlib.util
+import os
+import sys
+
+# appv1.5.py is not importable by name because of the dot, so it is loaded from its path
+_spec = importlib.util.spec_from_file_location(
+    "appv1_5", os.path.join(os.path.dirname(os.path.abspath(__file__)), "appv1.5.py")
+)
+_module = importlib.util.module_from_spec(_spec)
+# Registered before execution so that pickle can resolve the module's functions
+# by name when they are sent to the PDF worker processes
+sys.modules[_spec.name] = _module
+_spec.loader.exec_module(_module)
+
+app = _module.app